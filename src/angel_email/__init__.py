@@ -1,8 +1,11 @@
 from __future__ import annotations
 
 import argparse
+import logging
 import sys
-import traceback
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Optional
 
@@ -12,22 +15,41 @@ from angel_email.gmail_client import (
     resolve_label_ids,
     list_labels,
     list_message_ids,
-    get_message_raw,
-    get_message_metadata,
+    load_cached_label_map,
+    store_cached_label_map,
+    get_messages_batch,
     save_eml,
     save_attachment,
     clear_attachments_dir,
     cleanup_empty_attachments_dir,
     create_label_if_not_exists,
-    add_label_to_message,
+    batch_add_label_to_messages,
 )
 from angel_email.email_parser import (
     parse_eml_bytes,
-    extract_attachments,
     parse_message_object,
 )
 from angel_email import db as dbmod
 
+logger = logging.getLogger(__name__)
+
+
+def _configure_logging() -> None:
+    """Bind the progress logger to the current sys.stdout.
+
+    The handler is rebuilt on every main() invocation so the Flet UI's
+    stdout redirection (which swaps sys.stdout per run) keeps capturing
+    progress lines. Deferred %-formatting means skipped records cost
+    almost nothing.
+    """
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
 
 def project_root() -> Path:
     """Return the working directory used for default paths.
@@ -107,6 +129,7 @@ def main(argv: Optional[List[str]] = None) -> None:
     )
 
     args = parser.parse_args(argv)
+    _configure_logging()
 
     # Authenticate
     if not args.credentials.exists():
@@ -120,15 +143,18 @@ def main(argv: Optional[List[str]] = None) -> None:
     service = build_gmail_service(creds)
 
     # Show which Google account is authenticated so the user can verify it's the right one.
+    authed_email = None
     try:
         profile = service.users().getProfile(userId="me").execute()
         authed_email = profile.get("emailAddress", "<unknown>")
         messages_total = profile.get("messagesTotal", "?")
-        print(
-            f"Authenticated as: {authed_email} (total messages in mailbox: {messages_total})"
+        logger.info(
+            "Authenticated as: %s (total messages in mailbox: %s)",
+            authed_email,
+            messages_total,
         )
     except Exception as e:
-        print(f"Warning: could not fetch account profile: {e}")
+        logger.warning("Could not fetch account profile: %s", e)
 
     if args.list_labels:
         label_map = list_labels(service)
@@ -137,6 +163,9 @@ def main(argv: Optional[List[str]] = None) -> None:
         return
 
     label_names = [s.strip() for s in args.labels.split(",") if s.strip()]
+    # Frozen set for the per-message membership test in the download loop;
+    # the list keeps the user's ordering for the primary-label default.
+    label_names_set = frozenset(label_names)
     if not label_names:
         print(
             "--labels is required (comma-separated names), or use --list-labels to view options."
@@ -144,16 +173,36 @@ def main(argv: Optional[List[str]] = None) -> None:
         sys.exit(2)
 
     # Fetch labels once; reuse the map for both ID resolution and reverse-lookup
-    # to avoid a redundant network round-trip.
-    label_map = list_labels(service)
-    label_id_to_name = {v: k for k, v in label_map.items()}
+    # to avoid a redundant network round-trip. Labels change rarely, so the
+    # map is cached on disk next to token.json between invocations
+    # (--list-labels above always refreshes from the API).
+    labels_cache_path = args.token.parent / "labels_cache.json"
+    label_map = None
+    if authed_email:
+        label_map = load_cached_label_map(labels_cache_path, authed_email)
+    if label_map is None:
+        label_map = list_labels(service)
+        if authed_email:
+            store_cached_label_map(labels_cache_path, authed_email, label_map)
     try:
         label_ids = resolve_label_ids(
             service, label_names, label_map=label_map
         )
-    except ValueError as e:
-        print(str(e))
-        sys.exit(2)
+    except ValueError:
+        # The cache may be stale (e.g. a label created since the last run):
+        # refresh from the API — bypassing the in-process memo too — and
+        # retry once before giving up.
+        label_map = list_labels(service, use_cache=False)
+        if authed_email:
+            store_cached_label_map(labels_cache_path, authed_email, label_map)
+        try:
+            label_ids = resolve_label_ids(
+                service, label_names, label_map=label_map
+            )
+        except ValueError as e:
+            print(str(e))
+            sys.exit(2)
+    label_id_to_name = {v: k for k, v in label_map.items()}
 
     # Prepare output directories and DB
     base_emails_dir: Path = args.emails_dir
@@ -169,12 +218,13 @@ def main(argv: Optional[List[str]] = None) -> None:
             downloaded_label_id = create_label_if_not_exists(
                 service, downloaded_label_name
             )
-            print(
-                f"Will mark downloaded emails with label: {downloaded_label_name}"
+            logger.info(
+                "Will mark downloaded emails with label: %s",
+                downloaded_label_name,
             )
 
         # Fetch message IDs
-        print(f"Listing messages for labels: {', '.join(label_names)}")
+        logger.info("Listing messages for labels: %s", ", ".join(label_names))
         # Exclude already-downloaded messages so they are not re-downloaded (only if marking is enabled).
         combined_q = args.query
         if downloaded_label_name:
@@ -193,149 +243,308 @@ def main(argv: Optional[List[str]] = None) -> None:
         elif combined_q:
             combined_q = combined_q.strip() or None
 
-        print(f"Searching label IDs: {label_ids}")
+        logger.info("Searching label IDs: %s", label_ids)
         if combined_q:
-            print(f"Query filter: {combined_q}")
+            logger.info("Query filter: %s", combined_q)
         msg_ids = list_message_ids(
             service, label_ids=label_ids, max_results=args.max, q=combined_q
         )
-        print(f"Found {len(msg_ids)} messages")
+        logger.info("Found %d messages", len(msg_ids))
+
+        # Prune messages whose gmail_id is already in the local DB: the raw
+        # fetch is the biggest per-message cost, and re-running the upsert
+        # would produce identical rows anyway.
+        existing_ids = dbmod.get_existing_gmail_ids(conn)
+        if existing_ids:
+            before = len(msg_ids)
+            msg_ids = [m for m in msg_ids if m not in existing_ids]
+            if before != len(msg_ids):
+                logger.info(
+                    "Skipping %d messages already present in the database",
+                    before - len(msg_ids),
+                )
+
         if not msg_ids:
             if downloaded_label_name:
-                print(
-                    f"Hint: all matching messages may already be tagged '{downloaded_label_name}' "
+                logger.info(
+                    "Hint: all matching messages may already be tagged '%s' "
                     "from a previous run. To re-download them, clear that label in Gmail or "
-                    "run without --mark-downloaded."
+                    "run without --mark-downloaded.",
+                    downloaded_label_name,
                 )
             else:
-                print(
+                logger.info(
                     "Hint: check that the label names are correct and that you are "
                     "authenticated to the right Google account (see 'Authenticated as' above)."
                 )
 
-        # Download, save, parse, and upsert
-        for idx, mid in enumerate(msg_ids, start=1):
-            try:
-                raw_bytes = get_message_raw(service, mid)
-                meta = get_message_metadata(service, mid)
-                thread_id = meta.get("threadId")
-                snippet = meta.get("snippet")
-                msg_label_ids = meta.get("labelIds", [])
-
-                # Determine primary label folder (use first matching label from user's selection)
-                primary_label = label_names[
-                    0
-                ]  # Default to first requested label
-                for label_id in msg_label_ids:
-                    label_name = label_id_to_name.get(label_id, "")
-                    if label_name in label_names:
-                        primary_label = label_name
-                        break
-
-                # Create label-specific directory (strip any extra whitespace)
-                label_dir = base_emails_dir / primary_label.strip()
-                label_dir.mkdir(parents=True, exist_ok=True)
-
-                # Save .eml file in label folder
-                eml_path = save_eml(raw_bytes, label_dir, mid)
-
-                # Parse email once and extract all needed data
-                parsed, msg = parse_message_object(raw_bytes)
-                attachments = extract_attachments(msg)
-
-                # Upsert email data
-                dbmod.upsert_email(
-                    conn,
-                    gmail_id=mid,
-                    thread_id=thread_id,
-                    message_id=parsed.get("message_id"),
-                    subject=parsed.get("subject"),
-                    from_addr=parsed.get("from_"),
-                    to_addrs=parsed.get("to"),
-                    cc_addrs=parsed.get("cc"),
-                    bcc_addrs=parsed.get("bcc"),
-                    date=parsed.get("date"),
-                    snippet=snippet,
-                    text_body=parsed.get("text_body"),
-                    html_body=parsed.get("html_body"),
-                    headers=parsed.get("headers"),
-                    raw_eml_path=eml_path,
-                )
+        # Download, save, parse, and upsert. Messages are fetched in batches
+        # of 100 (one HTTP round-trip per batch instead of two per message).
+        # Chunks are downloaded concurrently — the fetch phase is network-
+        # bound — while parsing and DB writes stay in this thread, since the
+        # sqlite connection cannot be shared across threads. Each worker
+        # keeps its own service in thread-local storage — googleapiclient
+        # Resources share an httplib2.Http instance that is not thread-safe —
+        # built once per thread and reused across chunks so its keep-alive
+        # connections survive between batches. The bounded window of
+        # in-flight chunks keeps memory flat on large mailboxes.
+        worker_state = threading.local()
+
+        def _fetch_chunk(chunk: List[str]) -> dict:
+            worker_service = getattr(worker_state, "service", None)
+            if worker_service is None:
+                worker_service = build_gmail_service(creds)
+                worker_state.service = worker_service
+            return get_messages_batch(worker_service, chunk)
 
-                # Get the internal email ID for foreign key references
-                email_id = dbmod.get_email_id_by_gmail_id(conn, mid)
-                if email_id is None:
-                    print(
-                        f"  Warning: could not retrieve DB id for gmail_id={mid} after upsert; skipping labels and attachments"
+        chunks = [msg_ids[i : i + 100] for i in range(0, len(msg_ids), 100)]
+        idx = 0
+        with ThreadPoolExecutor(max_workers=4) as fetch_pool:
+            pending = deque(
+                (chunk, fetch_pool.submit(_fetch_chunk, chunk))
+                for chunk in chunks[:8]
+            )
+            next_chunk = 8
+            # Processed ids accumulate across chunks and are flushed to
+            # batchModify in full 1000-id requests (the endpoint's cap),
+            # with a final flush after the loop.
+            mids_to_mark: List[str] = []
+
+            def _flush_marks() -> None:
+                if not (downloaded_label_id and mids_to_mark):
+                    return
+                try:
+                    batch_add_label_to_messages(
+                        service, mids_to_mark, downloaded_label_id
                     )
-                if email_id:
-                    # Save label associations (filter out None values)
-                    label_tuples = [
-                        (label_id_to_name[lid], lid)
-                        for lid in msg_label_ids
-                        if lid in label_id_to_name
-                    ]
-                    if label_tuples:
-                        dbmod.insert_email_labels(
-                            conn, email_id=email_id, labels=label_tuples
+                except Exception as e:
+                    logger.warning(
+                        "  Failed to add label to %d messages: %s",
+                        len(mids_to_mark),
+                        e,
+                    )
+                mids_to_mark.clear()
+
+            while pending:
+                chunk, future = pending.popleft()
+                # The main thread spends most of its time blocked here, so
+                # this is where both Ctrl-C and fetch failures surface. A
+                # failed chunk is logged and skipped (its messages are
+                # simply re-fetched on the next run), never aborting the
+                # rest of the mailbox.
+                try:
+                    fetched = future.result()
+                except KeyboardInterrupt:
+                    logger.info("Interrupted by user")
+                    fetch_pool.shutdown(wait=False, cancel_futures=True)
+                    return
+                except Exception:
+                    logger.exception(
+                        "Failed to fetch chunk of %d messages; skipping",
+                        len(chunk),
+                    )
+                    fetched = {}
+                if next_chunk < len(chunks):
+                    pending.append(
+                        (
+                            chunks[next_chunk],
+                            fetch_pool.submit(
+                                _fetch_chunk, chunks[next_chunk]
+                            ),
                         )
+                    )
+                    next_chunk += 1
+                # Phase 1: parse messages and write files, collecting DB
+                # rows per message so the whole chunk can be flushed with a
+                # handful of executemany statements below.
+                email_rows: List[dict] = []
+                labels_by_gid: dict[str, list[tuple[str, str]]] = {}
+                attachments_by_gid: dict[str, list[tuple]] = {}
+                for mid in chunk:
+                    idx += 1
+                    if mid not in fetched:
+                        continue
+                    try:
+                        raw_bytes, meta = fetched[mid]
+                        thread_id = meta.get("threadId")
+                        snippet = meta.get("snippet")
+                        msg_label_ids = meta.get("labelIds", [])
 
-                    # Delete existing attachments before re-inserting (handles upsert case)
-                    dbmod.delete_attachments_for_email(conn, email_id)
-                    clear_attachments_dir(label_dir, mid)
-
-                    # Save attachments to disk and record in DB
-                    for attachment in attachments:
-                        try:
-                            attachment_path = save_attachment(
-                                attachment["data"],
-                                label_dir,
-                                mid,
-                                attachment["filename"],
-                            )
-                            dbmod.insert_attachment(
-                                conn,
-                                email_id=email_id,
-                                filename=attachment["filename"],
-                                content_type=attachment["content_type"],
-                                size=attachment["size"],
-                                file_path=attachment_path,
-                            )
-                        except Exception as e:
-                            print(
-                                f"  Warning: Failed to save attachment {attachment['filename']}: {e}"
-                            )
-                    # Remove the per-message dir if no attachments were saved
-                    cleanup_empty_attachments_dir(label_dir, mid)
+                        # Determine primary label folder (use first matching label from user's selection)
+                        primary_label = label_names[
+                            0
+                        ]  # Default to first requested label
+                        for label_id in msg_label_ids:
+                            label_name = label_id_to_name.get(label_id, "")
+                            if label_name in label_names_set:
+                                primary_label = label_name
+                                break
 
-                    # Single commit covers all attachment rows for this message.
-                    conn.commit()
+                        # Create label-specific directory (label names were
+                        # normalized at the CLI boundary)
+                        label_dir = base_emails_dir / primary_label
+                        label_dir.mkdir(parents=True, exist_ok=True)
 
-                # Mark email as downloaded in Gmail if option is enabled
-                if downloaded_label_id:
-                    try:
-                        add_label_to_message(service, mid, downloaded_label_id)
-                    except Exception as e:
-                        print(
-                            f"  Warning: Failed to add label to message {mid}: {e}"
+                        # Save .eml file in label folder
+                        eml_path = save_eml(raw_bytes, label_dir, mid)
+
+                        # Parse email once: bodies and attachments come
+                        # from a single walk over the MIME tree
+                        parsed, msg, attachments = parse_message_object(
+                            raw_bytes
                         )
 
-                if idx % 20 == 0 or idx == len(msg_ids):
-                    attachments_count = len(attachments) if attachments else 0
-                    print(
-                        f"Processed {idx}/{len(msg_ids)} (label: {primary_label}, attachments: {attachments_count})"
-                    )
-            except KeyboardInterrupt:
-                print("Interrupted by user")
-                return
-            except Exception as e:
-                print(f"Error processing message {mid}: {e}")
-                traceback.print_exc()
+                        email_rows.append(
+                            {
+                                "gmail_id": mid,
+                                "thread_id": thread_id,
+                                "message_id": parsed.get("message_id"),
+                                "subject": parsed.get("subject"),
+                                "from_addr": parsed.get("from_"),
+                                "to_addrs": parsed.get("to"),
+                                "cc_addrs": parsed.get("cc"),
+                                "bcc_addrs": parsed.get("bcc"),
+                                "date": parsed.get("date"),
+                                "snippet": snippet,
+                                "text_body": parsed.get("text_body"),
+                                "html_body": parsed.get("html_body"),
+                                "headers": parsed.get("headers"),
+                                "raw_eml_path": eml_path,
+                            }
+                        )
+
+                        # Label associations (filter out unknown label ids)
+                        labels_by_gid[mid] = [
+                            (label_id_to_name[lid], lid)
+                            for lid in msg_label_ids
+                            if lid in label_id_to_name
+                        ]
+
+                        # Save attachments to disk now; their DB rows are
+                        # recorded once the chunk's emails have ids.
+                        clear_attachments_dir(label_dir, mid)
+                        saved_attachments = []
+                        # The directory was just cleared, so duplicate names
+                        # only arise within this message's own attachments.
+                        used_names: set = set()
+                        for attachment in attachments:
+                            if attachment.skipped:
+                                logger.info(
+                                    "  Skipped oversized attachment %s (~%d bytes); raw copy remains in %s",
+                                    attachment.filename,
+                                    attachment.size,
+                                    eml_path.name,
+                                )
+                                continue
+                            try:
+                                attachment_path = save_attachment(
+                                    attachment.data,
+                                    label_dir,
+                                    mid,
+                                    attachment.filename,
+                                    existing_names=used_names,
+                                )
+                                saved_attachments.append(
+                                    (
+                                        attachment.filename,
+                                        attachment.content_type,
+                                        attachment.size,
+                                        attachment_path,
+                                    )
+                                )
+                            except Exception as e:
+                                logger.warning(
+                                    "  Failed to save attachment %s: %s",
+                                    attachment.filename,
+                                    e,
+                                )
+                        attachments_by_gid[mid] = saved_attachments
+                        # Remove the per-message dir if no attachments were saved
+                        cleanup_empty_attachments_dir(label_dir, mid)
+
+                        # Queue for the per-chunk batchModify below
+                        if downloaded_label_id:
+                            mids_to_mark.append(mid)
+
+                        if idx % 20 == 0 or idx == len(msg_ids):
+                            attachments_count = len(attachments) if attachments else 0
+                            logger.info(
+                                "Processed %d/%d (label: %s, attachments: %d)",
+                                idx,
+                                len(msg_ids),
+                                primary_label,
+                                attachments_count,
+                            )
+                    except KeyboardInterrupt:
+                        logger.info("Interrupted by user")
+                        fetch_pool.shutdown(
+                            wait=False, cancel_futures=True
+                        )
+                        return
+                    except Exception:
+                        logger.exception(
+                            "Error processing message %s", mid
+                        )
+
+                # Phase 2: flush the chunk in one transaction — a bulk email
+                # upsert plus one executemany each for labels, attachment
+                # deletes, and attachment inserts. sqlite3's context manager
+                # commits on exit (or rolls back on exception), so the whole
+                # chunk shares a single fsync.
+                if email_rows:
+                    with conn:
+                        id_map = dbmod.upsert_emails(conn, email_rows)
+                        label_rows = [
+                            (id_map[gid], name, lid)
+                            for gid, pairs in labels_by_gid.items()
+                            if gid in id_map
+                            for name, lid in pairs
+                        ]
+                        if label_rows:
+                            dbmod.insert_email_labels(conn, label_rows)
+                        # Clear old attachment rows before re-inserting
+                        # (handles the upsert case)
+                        dbmod.delete_attachments_for_emails(
+                            conn,
+                            [
+                                id_map[gid]
+                                for gid in attachments_by_gid
+                                if gid in id_map
+                            ],
+                        )
+                        attachment_rows = [
+                            (id_map[gid], filename, content_type, size, path)
+                            for gid, rows in attachments_by_gid.items()
+                            if gid in id_map
+                            for filename, content_type, size, path in rows
+                        ]
+                        if attachment_rows:
+                            dbmod.insert_attachments(conn, attachment_rows)
+                    missing_ids = [
+                        e["gmail_id"]
+                        for e in email_rows
+                        if e["gmail_id"] not in id_map
+                    ]
+                    if missing_ids:
+                        logger.warning(
+                            "  Could not retrieve DB ids for %d messages after upsert; their labels and attachments were skipped",
+                            len(missing_ids),
+                        )
+
+                # Marked ids are flushed only once a full batchModify
+                # request (1000 ids) is ready, so a whole run costs
+                # ceil(N/1000) modify calls. Messages stay unmarked until
+                # after their chunk's DB flush, so an interrupt never marks
+                # anything that was not ingested.
+                if len(mids_to_mark) >= 1000:
+                    _flush_marks()
+
+            _flush_marks()
 
         # Export all emails to CSV alongside the database
         csv_path = db_path.parent / "emails.csv"
         dbmod.export_csv(conn, csv_path)
-        print(f"Exported emails to {csv_path}")
-        print("Done.")
+        logger.info("Exported emails to %s", csv_path)
+        logger.info("Done.")
     finally:
         conn.close()
@@ -3,7 +3,12 @@ from __future__ import annotations
 import csv
 import json
 import sqlite3
-from email.utils import parsedate_to_datetime
+import zlib
+
+try:  # optional C serializer, 3-10x faster than stdlib json on the hot path
+    import orjson
+except ImportError:
+    orjson = None
 from pathlib import Path
 from typing import Any, Dict, Optional
 
@@ -24,7 +29,7 @@ SCHEMA = {
             snippet TEXT,
             text_body TEXT,
             html_body TEXT,
-            headers_json TEXT,
+            headers_blob BLOB,
             raw_eml_path TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
@@ -60,94 +65,119 @@ SCHEMA = {
 }
 
 
-def normalize_date(raw_date: Optional[str]) -> Optional[str]:
-    """Convert an RFC 2822 date string to yyyy/mm/dd hh:mm format.
-
-    If parsing fails the original value is returned unchanged.
-    """
-    if not raw_date:
-        return raw_date
-    try:
-        dt = parsedate_to_datetime(raw_date)
-        return dt.strftime("%Y/%m/%d %H:%M")
-    except Exception:
-        return raw_date
-
-
 def connect(db_path: Path) -> sqlite3.Connection:
     db_path.parent.mkdir(parents=True, exist_ok=True)
     conn = sqlite3.connect(str(db_path))
     conn.execute("PRAGMA journal_mode=WAL;")
     conn.execute("PRAGMA foreign_keys=ON;")
+    # Write-throughput PRAGMAs for bulk ingest. With WAL, synchronous=NORMAL
+    # only skips the fsync on each commit (the WAL itself is still synced at
+    # checkpoints), which is safe against application crashes.
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA cache_size=-65536;")  # 64 MiB page cache
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    conn.execute("PRAGMA mmap_size=268435456;")  # 256 MiB
+    conn.execute("PRAGMA wal_autocheckpoint=1000;")
     return conn
 
 
 def init_db(conn: sqlite3.Connection) -> None:
     for _, ddl in SCHEMA.items():
         conn.executescript(ddl)
+    # Databases created before headers were compressed have a headers_json
+    # TEXT column instead of headers_blob; CREATE TABLE IF NOT EXISTS won't
+    # touch them, so add the new column in place. Old rows keep their JSON
+    # text until the message is re-ingested.
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(emails)")}
+    if "headers_blob" not in columns:
+        conn.execute("ALTER TABLE emails ADD COLUMN headers_blob BLOB")
     conn.commit()
 
 
-def upsert_email(
-    conn: sqlite3.Connection,
-    *,
-    gmail_id: str,
-    thread_id: Optional[str],
-    message_id: Optional[str],
-    subject: Optional[str],
-    from_addr: Optional[str],
-    to_addrs: Optional[str],
-    cc_addrs: Optional[str],
-    bcc_addrs: Optional[str],
-    date: Optional[str],
-    snippet: Optional[str],
-    text_body: Optional[str],
-    html_body: Optional[str],
-    headers: Optional[Dict[str, Any]],
-    raw_eml_path: Path,
-) -> None:
-    headers_json = json.dumps(headers or {}, ensure_ascii=False)
-    date = normalize_date(date)
-    conn.execute(
-        """
-        INSERT INTO emails (
-            gmail_id, thread_id, message_id, subject, from_addr, to_addrs, cc_addrs, bcc_addrs,
-            date, snippet, text_body, html_body, headers_json, raw_eml_path
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ON CONFLICT(gmail_id) DO UPDATE SET
-            thread_id=excluded.thread_id,
-            message_id=excluded.message_id,
-            subject=excluded.subject,
-            from_addr=excluded.from_addr,
-            to_addrs=excluded.to_addrs,
-            cc_addrs=excluded.cc_addrs,
-            bcc_addrs=excluded.bcc_addrs,
-            date=excluded.date,
-            snippet=excluded.snippet,
-            text_body=excluded.text_body,
-            html_body=excluded.html_body,
-            headers_json=excluded.headers_json,
-            raw_eml_path=excluded.raw_eml_path
-        ;
-        """,
-        (
-            gmail_id,
-            thread_id,
-            message_id,
-            subject,
-            from_addr,
-            to_addrs,
-            cc_addrs,
-            bcc_addrs,
-            date,
-            snippet,
-            text_body,
-            html_body,
-            headers_json,
-            str(raw_eml_path),
-        ),
+def _serialize_headers(headers: Optional[Dict[str, Any]]) -> bytes:
+    # Raw headers compress ~5x at zlib level 3 (lots of repeated field names
+    # and routing hosts), which keeps the column from dominating DB size and
+    # page-cache traffic. Level 3 is near the speed/ratio knee for this data.
+    if orjson is not None:
+        raw = orjson.dumps(headers or {})
+    else:
+        raw = json.dumps(headers or {}, ensure_ascii=False).encode()
+    return zlib.compress(raw, 3)
+
+
+_UPSERT_EMAIL_SQL = """
+    INSERT INTO emails (
+        gmail_id, thread_id, message_id, subject, from_addr, to_addrs, cc_addrs, bcc_addrs,
+        date, snippet, text_body, html_body, headers_blob, raw_eml_path
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(gmail_id) DO UPDATE SET
+        thread_id=excluded.thread_id,
+        message_id=excluded.message_id,
+        subject=excluded.subject,
+        from_addr=excluded.from_addr,
+        to_addrs=excluded.to_addrs,
+        cc_addrs=excluded.cc_addrs,
+        bcc_addrs=excluded.bcc_addrs,
+        date=excluded.date,
+        snippet=excluded.snippet,
+        text_body=excluded.text_body,
+        html_body=excluded.html_body,
+        headers_blob=excluded.headers_blob,
+        raw_eml_path=excluded.raw_eml_path
+"""
+
+
+def upsert_emails(
+    conn: sqlite3.Connection, emails: list[Dict[str, Any]]
+) -> Dict[str, int]:
+    """Bulk upsert email rows and return a gmail_id -> internal id mapping.
+
+    Each dict carries the same fields as upsert_email's keyword arguments.
+    executemany cannot use RETURNING, so the id mapping comes from a single
+    follow-up SELECT over the chunk's gmail_ids. Does NOT commit — callers
+    own the transaction boundary.
+    """
+    if not emails:
+        return {}
+    conn.executemany(
+        _UPSERT_EMAIL_SQL,
+        [
+            (
+                e["gmail_id"],
+                e["thread_id"],
+                e["message_id"],
+                e["subject"],
+                e["from_addr"],
+                e["to_addrs"],
+                e["cc_addrs"],
+                e["bcc_addrs"],
+                e["date"],
+                e["snippet"],
+                e["text_body"],
+                e["html_body"],
+                _serialize_headers(e["headers"]),
+                str(e["raw_eml_path"]),
+            )
+            for e in emails
+        ],
     )
-    conn.commit()
+    gmail_ids = [e["gmail_id"] for e in emails]
+    placeholders = ", ".join("?" * len(gmail_ids))
+    return dict(
+        conn.execute(
+            f"SELECT gmail_id, id FROM emails WHERE gmail_id IN ({placeholders})",
+            gmail_ids,
+        )
+    )
+
+
+def get_existing_gmail_ids(conn: sqlite3.Connection) -> set[str]:
+    """Return the set of gmail_ids already ingested into the emails table.
+
+    Used by main() to prune the download list client-side so already-stored
+    messages skip the raw fetch entirely.
+    """
+    return {row[0] for row in conn.execute("SELECT gmail_id FROM emails")}
 
 
 def get_email_id_by_gmail_id(conn: sqlite3.Connection, gmail_id: str) -> Optional[int]:
@@ -157,54 +187,77 @@ def get_email_id_by_gmail_id(conn: sqlite3.Connection, gmail_id: str) -> Optiona
     return row[0] if row else None
 
 
-def delete_attachments_for_email(conn: sqlite3.Connection, email_id: int) -> None:
-    """Delete all attachments for an email (used before re-inserting on upsert)."""
-    conn.execute("DELETE FROM attachments WHERE email_id = ?", (email_id,))
-    conn.commit()
+def get_headers(conn: sqlite3.Connection, email_id: int) -> Optional[Dict[str, Any]]:
+    """Return an email's stored headers as a dict, decompressing on read."""
+    cursor = conn.execute(
+        "SELECT headers_blob FROM emails WHERE id = ?", (email_id,)
+    )
+    row = cursor.fetchone()
+    if row is None or row[0] is None:
+        return None
+    raw = zlib.decompress(row[0])
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
 
 
-def insert_attachment(
+def delete_attachments_for_emails(
+    conn: sqlite3.Connection, email_ids: list[int]
+) -> None:
+    """Delete attachment rows for the given emails (before re-inserting on upsert).
+
+    Does NOT commit — callers own the transaction boundary.
+    """
+    conn.executemany(
+        "DELETE FROM attachments WHERE email_id = ?",
+        [(email_id,) for email_id in email_ids],
+    )
+
+
+def insert_attachments(
     conn: sqlite3.Connection,
-    *,
-    email_id: int,
-    filename: str,
-    content_type: str,
-    size: int,
-    file_path: Path,
+    rows: list[tuple[int, str, str, int, Path]],
 ) -> None:
-    """Insert attachment metadata into the attachments table.
+    """Insert attachment metadata rows in one executemany call.
 
-    Does NOT commit — callers should commit once after inserting all attachments
-    for a message to keep the batch atomic and reduce round-trips.
+    rows is a list of (email_id, filename, content_type, size, file_path)
+    tuples, possibly spanning many emails. Does NOT commit — callers own the
+    transaction boundary.
     """
-    conn.execute(
+    conn.executemany(
         """
         INSERT INTO attachments (email_id, filename, content_type, size, file_path)
         VALUES (?, ?, ?, ?, ?)
         """,
-        (email_id, filename, content_type, size, str(file_path)),
+        [
+            (email_id, filename, content_type, size, str(file_path))
+            for email_id, filename, content_type, size, file_path in rows
+        ],
     )
 
 
 def insert_email_labels(
     conn: sqlite3.Connection,
-    *,
-    email_id: int,
-    labels: list[tuple[str, str]],
+    rows: list[tuple[int, str, str]],
 ) -> None:
-    """Insert label associations for an email. labels is list of (label_name, label_id) tuples."""
-    # First, remove existing labels for this email
-    conn.execute("DELETE FROM email_labels WHERE email_id = ?", (email_id,))
-    # Insert new labels
-    for label_name, label_id in labels:
-        conn.execute(
-            """
-            INSERT INTO email_labels (email_id, label_name, label_id)
-            VALUES (?, ?, ?)
-            """,
-            (email_id, label_name, label_id),
-        )
-    conn.commit()
+    """Insert label associations in one executemany call.
+
+    rows is a list of (email_id, label_name, label_id) tuples, possibly
+    spanning many emails. Idempotent: the upsert on the
+    (email_id, label_name) primary key means unchanged labels cost no extra
+    writes on re-runs.
+
+    Does NOT commit — callers own the transaction boundary.
+    """
+    conn.executemany(
+        """
+        INSERT INTO email_labels (email_id, label_name, label_id)
+        VALUES (?, ?, ?)
+        ON CONFLICT(email_id, label_name) DO UPDATE SET
+            label_id=excluded.label_id
+        """,
+        rows,
+    )
 
 
 def export_csv(conn: sqlite3.Connection, csv_path: Path) -> None:
@@ -222,10 +275,11 @@ def export_csv(conn: sqlite3.Connection, csv_path: Path) -> None:
         """
     )
     columns = [desc[0] for desc in cursor.description]
-    rows = cursor.fetchall()
 
     csv_path.parent.mkdir(parents=True, exist_ok=True)
     with open(csv_path, "w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
         writer.writerow(columns)
-        writer.writerows(rows)
+        # Iterate the cursor directly so rows (including full text/html
+        # bodies) stream from SQLite instead of being materialized at once.
+        writer.writerows(cursor)
@@ -1,8 +1,16 @@
 from __future__ import annotations
 
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from typing import Optional
 import json
+import os
+import threading
+
+try:  # optional C serializer, same pattern as db.py
+    import orjson
+except ImportError:
+    orjson = None
 
 import requests as _requests
 from google.auth.transport.requests import Request
@@ -17,6 +25,34 @@ SCOPES = [
     "https://www.googleapis.com/auth/gmail.labels",
 ]
 
+# Frozen once at import; the required-scope check compares against this
+# instead of rebuilding a set per load_credentials call.
+_SCOPES_FROZEN: frozenset[str] = frozenset(SCOPES)
+
+# Refresh only when the access token is within this margin of expiry.
+# Tokens normally live an hour, so most CLI invocations can skip the
+# token-endpoint round-trip entirely.
+_REFRESH_SKEW = timedelta(seconds=60)
+
+
+# Credentials resolved once per (client secrets, token) pair for the life
+# of the process: the Flet UI calls main() repeatedly in one interpreter,
+# and each call would otherwise re-read and re-parse the token file. The
+# lock covers concurrent first calls.
+_creds_cache: dict[tuple[str, str], Credentials] = {}
+_creds_cache_lock = threading.Lock()
+
+
+def _needs_refresh(creds: Credentials) -> bool:
+    """True when the access token is expired or about to expire."""
+    if creds.expired:
+        return True
+    if creds.expiry is None:
+        return False
+    # creds.expiry is a naive UTC datetime (google-auth convention)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return creds.expiry - now < _REFRESH_SKEW
+
 
 def load_credentials(credentials_path: Path, token_path: Path) -> Credentials:
     """
@@ -25,44 +61,57 @@ def load_credentials(credentials_path: Path, token_path: Path) -> Credentials:
     token_path: Path to save/restore the token JSON.
     Returns a valid Credentials object.
     """
+    cache_key = (str(credentials_path), str(token_path))
+    with _creds_cache_lock:
+        cached = _creds_cache.get(cache_key)
+        if cached is not None and cached.valid and not _needs_refresh(cached):
+            return cached
+
     creds: Optional[Credentials] = None
+    raw = ""
 
-    # Try load existing token if present
+    # Read and parse the token file once; scope check and credential
+    # construction both work off the same parsed dict.
     if token_path.exists():
         try:
-            creds = Credentials.from_authorized_user_file(
-                str(token_path), SCOPES
-            )
+            raw = token_path.read_text()
+            if not raw:
+                data = {}
+            elif orjson is not None:
+                data = orjson.loads(raw)
+            else:
+                data = json.loads(raw)
         except Exception as e:
             print(f"Warning: failed to load token from {token_path}: {e}")
-            creds = None
-
-        # Verify token contains required scopes; if not, remove it to force re-auth.
-        try:
-            raw = token_path.read_text()
-            data = json.loads(raw) if raw else {}
-        except Exception:
             data = {}
 
-        token_scopes = data.get("scopes") or data.get("scope") or []
-        if isinstance(token_scopes, str):
-            token_scopes = token_scopes.split()
-
-        token_scopes_set = set(token_scopes or [])
-        if not set(SCOPES).issubset(token_scopes_set):
-            try:
-                token_path.unlink()
-                print(
-                    f"Existing token at {token_path} lacks required scopes; removed to force re-auth."
-                )
-            except Exception:
-                print(
-                    f"Warning: failed to remove token at {token_path}; continuing to re-auth."
-                )
-            creds = None
+        if data:
+            token_scopes = data.get("scopes") or data.get("scope") or []
+            if isinstance(token_scopes, str):
+                token_scopes = token_scopes.split()
 
-    # Try refresh if possible
-    if creds and creds.expired and creds.refresh_token:
+            if not _SCOPES_FROZEN.issubset(token_scopes or ()):
+                # Token lacks required scopes; remove it to force re-auth.
+                try:
+                    token_path.unlink()
+                    print(
+                        f"Existing token at {token_path} lacks required scopes; removed to force re-auth."
+                    )
+                except Exception:
+                    print(
+                        f"Warning: failed to remove token at {token_path}; continuing to re-auth."
+                    )
+            else:
+                try:
+                    creds = Credentials.from_authorized_user_info(data, SCOPES)
+                except Exception as e:
+                    print(
+                        f"Warning: failed to load token from {token_path}: {e}"
+                    )
+
+    # Refresh only when actually (about to be) expired; a still-fresh token
+    # skips the token-endpoint round-trip on every startup.
+    if creds and creds.refresh_token and _needs_refresh(creds):
         try:
             creds.refresh(Request(session=_requests.Session()))
         except Exception:
@@ -89,14 +138,30 @@ def load_credentials(credentials_path: Path, token_path: Path) -> Credentials:
         creds = new_creds  # type: ignore[assignment]
         assert creds is not None  # Guaranteed by flow.run_local_server
 
-        # Save the credentials for the next run
+    # Save the credentials for the next run, but only when something changed
+    # (fresh flow or a refresh); an untouched token skips the disk write.
+    new_json = creds.to_json()
+    if new_json != raw:
         try:
             token_path.parent.mkdir(parents=True, exist_ok=True)
-            token_path.write_text(creds.to_json())
+            # Write to a sibling temp file and swap it into place so a crash
+            # mid-write can never leave a truncated token (which would force
+            # a full OAuth re-run on the next start). The file holds a
+            # refresh token, so it is created 0600 from the start rather
+            # than chmod'ed after the fact.
+            tmp_path = token_path.with_suffix(".json.tmp")
+            fd = os.open(
+                tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600
+            )
+            with os.fdopen(fd, "w") as f:
+                f.write(new_json)
+            os.replace(tmp_path, token_path)
             print(f"Saved credentials to {token_path}")
         except Exception as e:
             print(f"Warning: failed to save token to {token_path}: {e}")
 
     # At this point creds is guaranteed to be valid
     assert creds is not None, "Failed to obtain credentials"
+    with _creds_cache_lock:
+        _creds_cache[cache_key] = creds
     return creds
@@ -1,53 +1,151 @@
 from __future__ import annotations
 
-import base64
-import shutil
+import json
+import logging
+import os
+import time
+import weakref
+
+try:  # SIMD-accelerated base64 decode; the API mirrors the stdlib module
+    import pybase64 as _base64
+except ImportError:
+    import base64 as _base64
+from operator import itemgetter
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional
+from typing import Dict, List, Optional, Sequence, Tuple
 
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build, Resource
 
+logger = logging.getLogger(__name__)
+
 
 def build_gmail_service(credentials) -> Resource:
-    return build("gmail", "v1", credentials=credentials, cache_discovery=False)
+    """Build a Gmail API Resource with an explicit authorized transport.
+
+    Constructing the AuthorizedHttp here means every .execute() through
+    this Resource goes over the same httplib2.Http, whose keep-alive
+    connections are reused instead of paying a TCP+TLS handshake per
+    request. Resources are still built per thread (httplib2.Http is not
+    thread-safe), so there is deliberately no module-level singleton.
+    """
+    authed_http = AuthorizedHttp(credentials, http=httplib2.Http())
+    # static_discovery uses the Gmail discovery document shipped inside
+    # googleapiclient, so building a service costs no HTTPS fetch and no
+    # parse of the ~MB discovery JSON — it is also the only option that
+    # works offline. Matters doubly here since services are built per
+    # worker thread.
+    return build(
+        "gmail",
+        "v1",
+        http=authed_http,
+        cache_discovery=False,
+        static_discovery=True,
+    )
+
 
+# In-process memo for list_labels, keyed weakly by the service object.
+# Within one run several call sites (label resolution,
+# create_label_if_not_exists) would otherwise each issue their own
+# labels().list; a short TTL keeps them sharing one response without
+# going stale across long sessions. Weak keys mean a collected service
+# takes its entry with it — an id()-keyed dict would both leak entries
+# and risk handing a recycled id a stale map.
+_LABELS_MEMO_TTL = 60.0
+_labels_memo: "weakref.WeakKeyDictionary[Resource, Tuple[float, Dict[str, str]]]" = (
+    weakref.WeakKeyDictionary()
+)
 
-def list_labels(service: Resource) -> Dict[str, str]:
-    """Return mapping of label name -> label id for the authenticated user."""
-    resp = service.users().labels().list(userId="me").execute()
+# C-level (name, id) extraction for the label-map build below
+_name_id = itemgetter("name", "id")
+
+
+def list_labels(service: Resource, use_cache: bool = True) -> Dict[str, str]:
+    """Return mapping of label name -> label id for the authenticated user.
+
+    Responses are memoized per service instance for a short TTL; pass
+    use_cache=False to force a fresh API call.
+    """
+    if use_cache:
+        entry = _labels_memo.get(service)
+        if entry and time.monotonic() - entry[0] < _LABELS_MEMO_TTL:
+            return entry[1]
+    # Partial response: only names and ids are ever used from the listing
+    resp = (
+        service.users()
+        .labels()
+        .list(userId="me", fields="labels/id,labels/name")
+        .execute()
+    )
     labels = resp.get("labels", [])
-    return {lbl["name"]: lbl["id"] for lbl in labels}
+    label_map = dict(map(_name_id, labels))
+    _labels_memo[service] = (time.monotonic(), label_map)
+    return label_map
+
+
+# Labels change rarely, so the name->id map is cached on disk between CLI
+# invocations (keyed by account, since token.json may be reused across
+# accounts over time). One hour keeps the map fresh enough in practice.
+LABELS_CACHE_TTL = 3600.0
+
+
+def load_cached_label_map(
+    cache_path: Path, account: str, ttl: float = LABELS_CACHE_TTL
+) -> Optional[Dict[str, str]]:
+    """Return the cached label map for an account, or None if missing/stale."""
+    try:
+        data = json.loads(cache_path.read_text())
+        entry = data.get(account)
+        if entry and time.time() - float(entry.get("ts", 0)) < ttl:
+            labels = entry.get("labels")
+            if isinstance(labels, dict):
+                return labels
+    except Exception:
+        pass
+    return None
+
+
+def store_cached_label_map(
+    cache_path: Path, account: str, label_map: Dict[str, str]
+) -> None:
+    """Persist the label map for an account. Best-effort; failures are ignored."""
+    try:
+        try:
+            data = json.loads(cache_path.read_text())
+            if not isinstance(data, dict):
+                data = {}
+        except Exception:
+            data = {}
+        data[account] = {"labels": label_map, "ts": time.time()}
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(json.dumps(data))
+    except Exception:
+        pass
 
 
 def resolve_label_ids(
     service: Resource,
-    label_names: Iterable[str],
+    label_names: Sequence[str],
     label_map: Optional[Dict[str, str]] = None,
 ) -> List[str]:
     """Resolve label names to IDs.
 
     Args:
         service: Gmail API service.
-        label_names: Names to resolve.
+        label_names: Names to resolve. Expected pre-normalized (stripped,
+            non-empty) — the CLI boundary does that once, so resolution is
+            bare dict lookups.
         label_map: Pre-fetched name->id mapping.  When provided the function
             skips the API call, allowing callers to reuse a map they already
             hold and avoid a redundant network round-trip.
     """
     if label_map is None:
         label_map = list_labels(service)
-    ids: List[str] = []
-    missing: List[str] = []
-    for name in label_names:
-        name = name.strip()
-        if not name:
-            continue
-        if name in label_map:
-            ids.append(label_map[name])
-        else:
-            missing.append(name)
+    missing = [name for name in label_names if name not in label_map]
     if missing:
         raise ValueError(f"Labels not found: {', '.join(missing)}")
-    return ids
+    return [label_map[name] for name in label_names]
 
 
 def list_message_ids(
@@ -79,9 +177,16 @@ def list_message_ids(
     user = "me"
     ids: List[str] = []
     page_token: Optional[str] = None
-    fetched = 0
     while True:
-        params = {"userId": user}
+        # Always request Gmail's maximum page size (500) so large listings
+        # take as few HTTP round-trips as possible.
+        # Partial response: drop the per-message threadId the API would
+        # otherwise include, roughly halving the on-wire page size.
+        params = {
+            "userId": user,
+            "maxResults": 500,
+            "fields": "messages/id,nextPageToken",
+        }
         if label_ids:
             params["labelIds"] = label_ids
         if q:
@@ -89,18 +194,16 @@ def list_message_ids(
         if page_token:
             params["pageToken"] = page_token
         if max_results:
-            remaining = max_results - fetched
+            remaining = max_results - len(ids)
             if remaining <= 0:
                 break
             params["maxResults"] = min(500, remaining)
         resp = service.users().messages().list(**params).execute()
-        msgs = resp.get("messages", [])
-        for m in msgs:
-            ids.append(m["id"])
-            fetched += 1
-            if max_results and fetched >= max_results:
-                break
-        if max_results and fetched >= max_results:
+        page = resp.get("messages") or []
+        if max_results:
+            page = page[: max_results - len(ids)]
+        ids.extend(m["id"] for m in page)
+        if max_results and len(ids) >= max_results:
             break
         page_token = resp.get("nextPageToken")
         if not page_token:
@@ -118,10 +221,83 @@ def get_message_raw(service: Resource, msg_id: str) -> bytes:
     )
     raw_b64 = resp.get("raw", "")
     # Gmail returns base64url encoded string
-    raw_bytes = base64.urlsafe_b64decode(raw_b64.encode("utf-8"))
+    raw_bytes = _base64.urlsafe_b64decode(raw_b64)
     return raw_bytes
 
 
+def get_messages_batch(
+    service: Resource, msg_ids: List[str], batch_size: int = 100
+) -> Dict[str, Tuple[bytes, dict]]:
+    """Fetch multiple messages with format='raw' via the Gmail batch endpoint.
+
+    Returns a mapping of gmail_id -> (raw_bytes, metadata) where metadata is
+    the full response dict (threadId, snippet, labelIds, ...). The raw-format
+    response already carries those fields, so a single batched get replaces
+    the former two round-trips per message (raw + metadata) with one HTTP
+    call per `batch_size` messages.
+
+    Messages that fail inside the batch are reported and omitted from the
+    result; if the batch endpoint itself errors, the chunk falls back to
+    sequential per-message requests.
+    """
+    results: Dict[str, Tuple[bytes, dict]] = {}
+    for start in range(0, len(msg_ids), batch_size):
+        chunk = msg_ids[start : start + batch_size]
+        responses: Dict[str, dict] = {}
+        errors: Dict[str, Exception] = {}
+
+        def _collect(request_id, response, exception):
+            if exception is not None:
+                errors[request_id] = exception
+            else:
+                responses[request_id] = response
+
+        batch = service.new_batch_http_request(callback=_collect)
+        for mid in chunk:
+            batch.add(
+                service.users()
+                .messages()
+                .get(userId="me", id=mid, format="raw"),
+                request_id=mid,
+            )
+        try:
+            batch.execute()
+        except Exception as e:
+            # Not just HttpError: long bulk downloads also hit transport
+            # failures (timeouts, connection resets, DNS/SSL errors) that
+            # must degrade to a retry, not kill the run.
+            logger.warning(
+                "  Batch fetch failed (%s); retrying chunk sequentially", e
+            )
+            for mid in chunk:
+                try:
+                    resp = (
+                        service.users()
+                        .messages()
+                        .get(userId="me", id=mid, format="raw")
+                        .execute()
+                    )
+                    raw_b64 = resp.get("raw", "")
+                    results[mid] = (
+                        _base64.urlsafe_b64decode(raw_b64),
+                        resp,
+                    )
+                except Exception as e2:
+                    logger.warning(
+                        "  Failed to fetch message %s: %s", mid, e2
+                    )
+            continue
+        for mid, exc in errors.items():
+            logger.warning("  Failed to fetch message %s: %s", mid, exc)
+        for mid, resp in responses.items():
+            raw_b64 = resp.get("raw", "")
+            results[mid] = (
+                _base64.urlsafe_b64decode(raw_b64),
+                resp,
+            )
+    return results
+
+
 def get_message_metadata(service: Resource, msg_id: str) -> dict:
     resp = (
         service.users()
@@ -130,6 +306,7 @@ def get_message_metadata(service: Resource, msg_id: str) -> dict:
             userId="me",
             id=msg_id,
             format="metadata",
+            fields="id,threadId,snippet,labelIds,payload/headers",
             metadataHeaders=[
                 "Message-ID",
                 "Subject",
@@ -145,13 +322,25 @@ def get_message_metadata(service: Resource, msg_id: str) -> dict:
     return resp
 
 
-import shutil
+# Buffer size for .eml/attachment writes. A large explicit buffer batches
+# the write()s into fewer syscalls, which matters on slow/network
+# filesystems; local disks are unaffected.
+_WRITE_BUFFER_SIZE = 1024 * 1024
 
 
 def save_eml(raw_bytes: bytes, out_dir: Path, gmail_id: str) -> Path:
     out_dir.mkdir(parents=True, exist_ok=True)
     path = out_dir / f"{gmail_id}.eml"
-    path.write_bytes(raw_bytes)
+    # Raw RFC822 content for a given gmail_id is immutable, so a matching
+    # size means the file is already this exact message: one stat() instead
+    # of a redundant rewrite on re-runs.
+    try:
+        if path.stat().st_size == len(raw_bytes):
+            return path
+    except OSError:
+        pass
+    with open(path, "wb", buffering=_WRITE_BUFFER_SIZE) as f:
+        f.write(raw_bytes)
     return path
 
 
@@ -159,14 +348,26 @@ def clear_attachments_dir(out_dir: Path, gmail_id: str) -> None:
     """
     Remove the attachments directory for a message if it exists.
     Called before re-saving attachments to avoid orphaned files on re-runs.
+
+    The per-message directory is always flat, so a scandir + unlink + rmdir
+    replaces shutil.rmtree's recursive stat/symlink machinery.
     """
     attachments_dir = out_dir / "attachments" / gmail_id
-    if attachments_dir.exists():
-        shutil.rmtree(attachments_dir)
+    try:
+        with os.scandir(attachments_dir) as it:
+            for entry in it:
+                os.unlink(entry.path)
+        os.rmdir(attachments_dir)
+    except FileNotFoundError:
+        pass
 
 
 def save_attachment(
-    attachment_data: bytes, out_dir: Path, gmail_id: str, filename: str
+    attachment_data: bytes,
+    out_dir: Path,
+    gmail_id: str,
+    filename: str,
+    existing_names: Optional[set[str]] = None,
 ) -> Path:
     """
     Save an attachment to disk in a structured folder.
@@ -176,6 +377,10 @@ def save_attachment(
         out_dir: Base directory for attachments (e.g., emails/INBOX/attachments)
         gmail_id: Gmail message ID (used for organizing)
         filename: Original filename of the attachment
+        existing_names: Filenames already used in this message's directory.
+            When the caller threads one set across a message's attachments,
+            duplicate names are resolved against it instead of stat()ing the
+            disk per candidate. Mutated in place with the chosen name.
 
     Returns:
         Path to the saved attachment file
@@ -188,20 +393,23 @@ def save_attachment(
     # subdirectories that don't exist (e.g. filenames like "subdir/file.pdf").
     filename = Path(filename).name or "attachment"
 
-    # Save the attachment with its original filename
-    attachment_path = attachments_dir / filename
+    if existing_names is None:
+        # One directory read instead of a stat() per candidate name
+        existing_names = {entry.name for entry in os.scandir(attachments_dir)}
 
     # Handle duplicate filenames by adding a suffix
+    candidate = filename
+    stem = Path(filename).stem
+    suffix = Path(filename).suffix
     counter = 1
-    original_stem = attachment_path.stem
-    original_suffix = attachment_path.suffix
-    while attachment_path.exists():
-        attachment_path = (
-            attachments_dir / f"{original_stem}_{counter}{original_suffix}"
-        )
+    while candidate in existing_names:
+        candidate = f"{stem}_{counter}{suffix}"
         counter += 1
+    existing_names.add(candidate)
+    attachment_path = attachments_dir / candidate
 
-    attachment_path.write_bytes(attachment_data)
+    with open(attachment_path, "wb", buffering=_WRITE_BUFFER_SIZE) as f:
+        f.write(attachment_data)
 
     return attachment_path
 
@@ -242,6 +450,9 @@ def create_label_if_not_exists(service: Resource, label_name: str) -> str:
         .create(userId="me", body=label_object)
         .execute()
     )
+    # Mutate the memoized map in place so subsequent list_labels callers
+    # see the new label without another API round-trip.
+    label_map[label_name] = result["id"]
     return result["id"]
 
 
@@ -259,3 +470,24 @@ def add_label_to_message(
     service.users().messages().modify(
         userId="me", id=msg_id, body={"addLabelIds": [label_id]}
     ).execute()
+
+
+def batch_add_label_to_messages(
+    service: Resource, msg_ids: List[str], label_id: str
+) -> None:
+    """
+    Add a label to many Gmail messages at once.
+
+    batchModify accepts up to 1000 message IDs per call, so N per-message
+    modify requests collapse into ceil(N/1000) HTTP round-trips.
+
+    Args:
+        service: Gmail API service instance
+        msg_ids: Gmail message IDs to modify
+        label_id: Label ID to add to the messages
+    """
+    for start in range(0, len(msg_ids), 1000):
+        chunk = msg_ids[start : start + 1000]
+        service.users().messages().batchModify(
+            userId="me", body={"ids": chunk, "addLabelIds": [label_id]}
+        ).execute()
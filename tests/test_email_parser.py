@@ -0,0 +1,62 @@
+import sys
+sys.path.insert(0, "src")
+
+from angel_email.email_parser import parse_eml_bytes, parse_message_object
+
+
+def test_raw_8bit_headers_do_not_crash():
+    """Headers with raw (non-RFC-2047) 8-bit bytes must parse, not raise.
+
+    compat32 returns email.header.Header objects for such headers instead
+    of str; the parser has to cope with them in every header it touches.
+    """
+    raw = (
+        b"From: caf\xe9 <cafe@example.com>\r\n"
+        b"To: d@e.f\r\n"
+        b"Subject: caf\xe9 menu\r\n"
+        b"X-Mailer: mailer caf\xe9\r\n"
+        b"Date: Mon, 01 Jan 2024 10:30:00 +0000\r\n"
+        b"Content-Type: text/plain\r\n"
+        b"\r\n"
+        b"body\r\n"
+    )
+    parsed = parse_eml_bytes(raw)
+    assert "caf" in parsed["subject"]
+    assert "cafe@example.com" in parsed["from_"]
+    assert parsed["text_body"].strip() == "body"
+    # The stored headers dict must be plain strings (JSON-serializable),
+    # including non-exposed headers like X-Mailer.
+    assert all(isinstance(v, str) for v in parsed["headers"].values())
+
+
+def test_8bit_content_disposition_attachment():
+    """An 8-bit Content-Disposition header must not drop the message."""
+    raw = (
+        b"From: a@b.c\r\n"
+        b"MIME-Version: 1.0\r\n"
+        b"Content-Type: multipart/mixed; boundary=XX\r\n"
+        b"\r\n"
+        b"--XX\r\n"
+        b"Content-Type: text/plain\r\n"
+        b"\r\n"
+        b"body\r\n"
+        b"--XX\r\n"
+        b'Content-Type: application/pdf; name="f\xe9.pdf"\r\n'
+        b'Content-Disposition: attachment; filename="f\xe9.pdf"\r\n'
+        b"Content-Transfer-Encoding: base64\r\n"
+        b"\r\n"
+        b"QUJD\r\n"
+        b"--XX--\r\n"
+    )
+    parsed, msg, attachments = parse_message_object(raw)
+    assert parsed["text_body"].strip() == "body"
+    assert len(attachments) == 1
+    assert attachments[0].data == b"ABC"
+    assert attachments[0].filename.endswith(".pdf")
+
+
+if __name__ == "__main__":
+    test_raw_8bit_headers_do_not_crash()
+    print("8-bit headers test OK")
+    test_8bit_content_disposition_attachment()
+    print("8-bit disposition test OK")
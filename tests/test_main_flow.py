@@ -47,12 +47,15 @@ def run_one_scenario(mark_downloaded_arg: str | None):
             recorded['q'] = q
             return ["mid1"]
 
-        def fake_get_message_raw(service, mid):
-            recorded.setdefault('raws', []).append(mid)
-            return b"raw-eml-bytes"
-
-        def fake_get_message_metadata(service, mid):
-            return {"threadId": "t1", "snippet": "s1", "labelIds": ["someLabelId"]}
+        def fake_get_messages_batch(service, mids, batch_size=100):
+            recorded.setdefault('fetched', []).extend(mids)
+            return {
+                mid: (
+                    b"raw-eml-bytes",
+                    {"threadId": "t1", "snippet": "s1", "labelIds": ["someLabelId"]},
+                )
+                for mid in mids
+            }
 
         def fake_save_eml(raw_bytes, out_dir, gmail_id):
             recorded.setdefault('saved', []).append((out_dir, gmail_id))
@@ -62,10 +65,7 @@ def run_one_scenario(mark_downloaded_arg: str | None):
             return out
 
         def fake_parse_message_object(raw):
-            return {}, MagicMock()
-
-        def fake_extract_attachments(msg):
-            return []
+            return {}, MagicMock(), []
 
         # DB stubs
         recorded_db = {}
@@ -75,24 +75,25 @@ def run_one_scenario(mark_downloaded_arg: str | None):
         def fake_init_db(conn):
             recorded_db['init_db'] = True
 
-        def fake_upsert_email(*args, **kwargs):
-            recorded_db.setdefault('upsert', []).append(True)
+        def fake_get_existing_gmail_ids(conn):
+            return set()
 
-        def fake_get_email_id_by_gmail_id(conn, gid):
-            return 1
+        def fake_upsert_emails(conn, emails):
+            recorded_db.setdefault('upsert', []).extend(e["gmail_id"] for e in emails)
+            return {e["gmail_id"]: i + 1 for i, e in enumerate(emails)}
 
-        def fake_insert_email_labels(conn, email_id, labels):
-            recorded_db.setdefault('labels', []).append(labels)
+        def fake_insert_email_labels(conn, rows):
+            recorded_db.setdefault('labels', []).extend(rows)
 
-        def fake_delete_attachments_for_email(conn, email_id):
-            recorded_db.setdefault('deleted_attachments', []).append(email_id)
+        def fake_delete_attachments_for_emails(conn, email_ids):
+            recorded_db.setdefault('deleted_attachments', []).extend(email_ids)
 
-        def fake_insert_attachment(*args, **kwargs):
-            recorded_db.setdefault('attachments', []).append(True)
+        def fake_insert_attachments(conn, rows):
+            recorded_db.setdefault('attachments', []).extend(rows)
 
         added = []
-        def fake_add_label_to_message(service, msg_id, label_id):
-            added.append((msg_id, label_id))
+        def fake_batch_add_label_to_messages(service, msg_ids, label_id):
+            added.extend((mid, label_id) for mid in msg_ids)
 
         # Patch
         angel_email.load_credentials = fake_load_credentials
@@ -101,19 +102,17 @@ def run_one_scenario(mark_downloaded_arg: str | None):
         angel_email.resolve_label_ids = lambda service, names, label_map=None: ["INBOXID"]
         angel_email.list_labels = lambda service: {"INBOX": "INBOXID"}
         angel_email.list_message_ids = fake_list_message_ids
-        angel_email.get_message_raw = fake_get_message_raw
-        angel_email.get_message_metadata = fake_get_message_metadata
+        angel_email.get_messages_batch = fake_get_messages_batch
         angel_email.save_eml = fake_save_eml
         angel_email.parse_message_object = fake_parse_message_object
-        angel_email.extract_attachments = fake_extract_attachments
         angel_email.db.connect = fake_connect
         angel_email.db.init_db = fake_init_db
-        angel_email.db.upsert_email = fake_upsert_email
-        angel_email.db.get_email_id_by_gmail_id = fake_get_email_id_by_gmail_id
+        angel_email.db.get_existing_gmail_ids = fake_get_existing_gmail_ids
+        angel_email.db.upsert_emails = fake_upsert_emails
         angel_email.db.insert_email_labels = fake_insert_email_labels
-        angel_email.db.delete_attachments_for_email = fake_delete_attachments_for_email
-        angel_email.db.insert_attachment = fake_insert_attachment
-        angel_email.add_label_to_message = fake_add_label_to_message
+        angel_email.db.delete_attachments_for_emails = fake_delete_attachments_for_emails
+        angel_email.db.insert_attachments = fake_insert_attachments
+        angel_email.batch_add_label_to_messages = fake_batch_add_label_to_messages
 
         # Run
         angel_email.main(args)